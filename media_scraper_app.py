@@ -1,82 +1,341 @@
+import atexit
+import codecs
+import contextlib
 import os
+import re
 import shutil
 import tempfile
-from urllib.parse import urljoin, urlparse
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.message import Message
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urljoin, urlsplit
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import requests
 import streamlit as st
-from bs4 import BeautifulSoup
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+MAX_WORKERS = 16
+PAGE_CACHE_SIZE = 128
+DOWNLOAD_CACHE_TTL = 600  # seconds a finished download batch is reused
+CHUNK_SIZE = 1 << 20  # 1 MiB per read keeps large videos out of Python loops
+MAX_PREALLOCATE = 1 << 30  # only reserve disk space up front for files <= 1 GiB
 
-def is_media_url(url: str) -> bool:
-    """Check if a URL ends with a common image or video extension."""
-    ext = os.path.splitext(urlparse(url).path)[1].lower()
-    return ext in {
-        ".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg",
-        ".mp4", ".webm", ".ogg", ".mov", ".avi", ".mkv"
-    }
+# urlsplit strips leading C0 controls/spaces and drops tabs and newlines
+_URL_LSTRIP = "".join(map(chr, range(0x21)))
+_URL_DROP = str.maketrans("", "", "\t\r\n")
 
+# Extension at the end of the last path segment (ignoring leading dots, as
+# splitext does), before any ;params, query string or fragment. The scheme
+# and //authority are consumed first (the lookahead + backreference stops
+# backtracking), so a host such as //cdn.png is never read as a path.
+_MEDIA_RE = re.compile(
+    r"(?=((?:[A-Za-z][A-Za-z0-9+.-]*:)?(?://[^/?#]*)?))\1"
+    r"(?:[^?#]*/)?\.*[^/;?#.][^/;?#]*"
+    r"\.(?:png|jpe?g|gif|webp|svg|mp4|webm|ogg|mov|avi|mkv)"
+    r"(?:;[^/?#]*)?(?:[?#].*)?\Z",
+    re.IGNORECASE | re.DOTALL,
+)
 
-def collect_media_links(page_url: str) -> list[str]:
-    """Fetch the page and return absolute URLs of all media files."""
-    headers = {
+# Formats that are already compressed; deflating them again only burns CPU.
+_STORED_EXTS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp",
+    ".mp4", ".webm", ".ogg", ".mov", ".avi", ".mkv"
+}
+
+
+@st.cache_resource
+def _build_session() -> requests.Session:
+    """Return one pooled HTTP session shared by every script rerun."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.3),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # The session is shared by every user, so never keep cookies between them
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.headers.update({
         "User-Agent": (
             "Mozilla/5.0 (compatible; MediaScraper/1.0; "
             "+https://github.com/nostrum01media-byte/Scraper)"
         )
-    }
-    resp = requests.get(page_url, timeout=15, headers=headers)
+    })
+    atexit.register(session.close)
+    return session
+
+
+_SESSION = _build_session()
+
+
+def _clean_url(url: str) -> str:
+    """Apply the same whitespace cleanup that urlsplit does."""
+    return url.lstrip(_URL_LSTRIP).translate(_URL_DROP)
+
+
+def is_media_url(url: str) -> bool:
+    """Check if a URL ends with a common image or video extension."""
+    return _MEDIA_RE.match(_clean_url(url)) is not None
+
+
+class _MediaCollector:
+    """lxml parser target that keeps media `src` attributes as tags open."""
+
+    def __init__(self, page_url: str):
+        self.page_url = page_url
+        self.media_urls = set()
+        self._open_videos = 0
+        # Split the page URL once instead of inside every urljoin call
+        base = urlsplit(page_url)
+        self._scheme = base.scheme
+        self._origin = f"{base.scheme}://{base.netloc}"
+
+    def _join(self, src: str) -> str:
+        """Resolve `src` against the page, short-cutting the common forms."""
+        src = _clean_url(src)
+        # Dot segments and a bare trailing ? or # are normalised by urljoin
+        if "/." not in src and not src.endswith(("?", "#")):
+            if src.startswith(("http://", "https://", "//")):
+                scheme, _, rest = src.partition("//")
+                if rest[:1] not in ("", "/", "?", "#"):  # empty host = no host
+                    return src if scheme else f"{self._scheme}:{src}"
+            elif src.startswith("/"):
+                return self._origin + src
+        # Relative paths and anything unusual need full RFC 3986 resolution
+        return urljoin(self.page_url, src)
+
+    def start(self, tag: str, attrib: dict) -> None:
+        # Images, videos and <source> tags inside <video>
+        if tag == "video":
+            self._open_videos += 1
+        elif tag != "img" and not (tag == "source" and self._open_videos):
+            return
+        src = attrib.get("src")
+        # Check the raw attribute so non-media links are never resolved
+        if src and is_media_url(src):
+            self.media_urls.add(self._join(src))
+
+    def end(self, tag: str) -> None:
+        if tag == "video" and self._open_videos:
+            self._open_videos -= 1
+
+    def close(self) -> list[str]:
+        return sorted(self.media_urls)
+
+
+def _html_parser(target: _MediaCollector, content_type: str) -> etree.HTMLParser:
+    """Build an lxml HTML parser that honours the Content-Type charset.
+
+    Without one lxml falls back to the document's <meta charset> or a guess.
+    resp.encoding is not used: it defaults to ISO-8859-1 for text/* and
+    would override the <meta> declaration.
+    """
+    msg = Message()
+    msg["Content-Type"] = content_type
+    charset = msg.get_content_charset()
+    if charset:
+        # libxml2 knows most header names; Python's canonical name covers
+        # aliases such as latin-1
+        try:
+            names = (charset, codecs.lookup(charset).name)
+        except LookupError:
+            names = (charset,)
+        for name in names:
+            try:
+                return etree.HTMLParser(target=target, encoding=name)
+            except LookupError:
+                pass
+    return etree.HTMLParser(target=target)
+
+
+@st.cache_resource
+def _page_cache() -> tuple[OrderedDict, threading.Lock]:
+    """Return the process-wide LRU of page URL -> (ETag, Last-Modified, links).
+
+    Every Streamlit session thread shares it, so hold the lock while using it.
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def _remember_page(cache: OrderedDict, page_url: str, entry: tuple) -> None:
+    """Store `entry` as the most recently used page, evicting the oldest."""
+    cache[page_url] = entry
+    cache.move_to_end(page_url)
+    if len(cache) > PAGE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def collect_media_links(page_url: str) -> list[str]:
+    """Fetch the page and return absolute URLs of all media files."""
+    cache, lock = _page_cache()
+    with lock:
+        cached = cache.get(page_url)
+    headers = {}
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    resp = _SESSION.get(page_url, timeout=15, headers=headers)
+    if cached and resp.status_code == 304:
+        with lock:
+            _remember_page(cache, page_url, cached)
+        return list(cached[2])
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
-
-    media_urls = set()
-
-    # Images
-    for img in soup.find_all("img"):
-        src = img.get("src")
-        if src:
-            media_urls.add(urljoin(page_url, src))
-
-    # Videos and <source> tags inside <video>
-    for video in soup.find_all("video"):
-        src = video.get("src")
-        if src:
-            media_urls.add(urljoin(page_url, src))
-        for source in video.find_all("source"):
-            src = source.get("src")
-            if src:
-                media_urls.add(urljoin(page_url, src))
-
-    # Keep only known media extensions
-    return [u for u in media_urls if is_media_url(u)]
-
-
-def download_media(urls: list[str], out_dir: str) -> list[str]:
-    """Download each URL into `out_dir`; return list of saved file paths."""
-    saved_files = []
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (compatible; MediaScraper/1.0; "
-            "+https://github.com/nostrum01media-byte/Scraper)"
-        )
-    }
+    # Stream parse events into the collector instead of building a tree
+    content_type = resp.headers.get("Content-Type", "")
+    parser = _html_parser(_MediaCollector(page_url), content_type)
+    links = etree.fromstring(resp.content, parser)
+
+    # Remember validators so the next scrape of this page can get a 304
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    with lock:
+        if etag or last_modified:
+            _remember_page(cache, page_url, (etag, last_modified, links))
+        else:
+            # Stale validators would keep being sent and a 304 would return
+            # links from an outdated parse
+            cache.pop(page_url, None)
+    return list(links)
+
+
+def _target_paths(urls: list[str], out_dir: str) -> list[str]:
+    """Pick a distinct file path in `out_dir` for every URL."""
+    paths, seen = [], set()
     for url in urls:
+        filename = os.path.basename(url.split("?")[0])
+        if not filename:
+            filename = "file_" + os.urandom(4).hex()
+        stem, ext = os.path.splitext(filename)
+        n = 1
+        while filename in seen:
+            filename = f"{stem}_{n}{ext}"
+            n += 1
+        seen.add(filename)
+        paths.append(os.path.join(out_dir, filename))
+    return paths
+
+
+def _preallocate(f, headers) -> None:
+    """Reserve disk space for a body whose on-disk size is known up front."""
+    size = headers.get("Content-Length", "")
+    # A content-encoded body is decoded while copying, so its length differs
+    if not size.isdigit() or headers.get("Content-Encoding", "identity") != "identity":
+        return
+    # The length is server-supplied; don't let a bogus one reserve huge files
+    if int(size) > MAX_PREALLOCATE:
+        return
+    if hasattr(os, "posix_fallocate"):
         try:
-            st.write(f"Attempting to download: {url}")
-            r = requests.get(url, stream=True, timeout=15, headers=headers)
+            os.posix_fallocate(f.fileno(), 0, int(size))
+        except OSError:
+            pass  # filesystem doesn't support it; plain writes still work
+
+
+def _download_one(url: str, path: str) -> tuple[str | None, Exception | None]:
+    """Stream `url` into `path`; return `(path, None)` or `(None, error)`."""
+    try:
+        with _SESSION.get(url, stream=True, timeout=15) as r:
             r.raise_for_status()
-            filename = os.path.basename(url.split("?")[0])
-            if not filename:
-                filename = "file_" + os.urandom(4).hex()
-            path = os.path.join(out_dir, filename)
+            r.raw.decode_content = True  # still undo gzip/deflate encoding
             with open(path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            saved_files.append(path)
-            st.success(f"Downloaded {filename}")
-        except Exception as e:
-            st.error(f"❌ Failed to download {url}: {e}")
-    return saved_files
+                try:
+                    _preallocate(f, r.headers)
+                    shutil.copyfileobj(r.raw, f, length=CHUNK_SIZE)
+                finally:
+                    f.truncate()  # drop any reserved space the body didn't fill
+    except Exception as e:
+        # A partial file is never previewed or zipped, so don't leave it behind
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        return None, e
+    return path, None
+
+
+def download_media(urls: list[str], out_dir: str) -> list[tuple[str, str]]:
+    """Download each URL into `out_dir`; return `(url, path)` for saved files."""
+    if not urls:
+        return []
+    results = {}
+    progress = st.progress(0.0)
+    # Network waits release the GIL, so a small thread pool keeps the
+    # pooled session busy. Streamlit calls stay on the script thread.
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(urls))) as pool:
+        futures = {
+            pool.submit(_download_one, url, path): url
+            for url, path in zip(urls, _target_paths(urls, out_dir))
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            progress.progress(done / len(urls), text=f"{done}/{len(urls)} files processed")
+
+    # One summary table instead of a message per file
+    rows = []
+    for url in urls:
+        path, error = results[url]
+        rows.append({
+            "URL": url,
+            "Status": "✅ Downloaded" if error is None else "❌ Failed",
+            "Details": os.path.basename(path) if error is None else str(error),
+        })
+    st.dataframe(rows)
+    return [(url, results[url][0]) for url in urls if results[url][1] is None]
+
+
+def build_zip(paths: list[str], zip_path: str) -> None:
+    """Write `paths` into a flat ZIP archive at `zip_path`."""
+    with ZipFile(zip_path, "w") as zf:
+        for path in paths:
+            ext = os.path.splitext(path)[1].lower()
+            compression = ZIP_STORED if ext in _STORED_EXTS else ZIP_DEFLATED
+            zf.write(path, os.path.basename(path), compress_type=compression)
+
+
+class _TempDir:
+    """A scraper_ temp dir that is deleted once nothing references it."""
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix="scraper_")
+        # Fires when the cache entry is dropped (TTL expiry, clear()) and no
+        # script run still holds it, or at the latest at interpreter exit
+        self.remove = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+
+
+@st.cache_resource(show_spinner=False, ttl=DOWNLOAD_CACHE_TTL)
+def _download_once(
+    media_links: tuple[str, ...],
+) -> tuple[_TempDir, list[tuple[str, str]], str | None]:
+    """Download and zip `media_links` in a temp dir, reused across reruns."""
+    tmp_dir = _TempDir()
+    downloaded = download_media(list(media_links), tmp_dir.path)
+    if not downloaded:
+        return tmp_dir, downloaded, None
+    zip_path = os.path.join(tmp_dir.path, "media.zip")
+    build_zip([path for _, path in downloaded], zip_path)
+    return tmp_dir, downloaded, zip_path
+
+
+def _download_batch(
+    media_links: list[str],
+) -> tuple[_TempDir, list[tuple[str, str]], str | None]:
+    """Download `media_links` through the cache, keeping only complete batches."""
+    key = tuple(media_links)
+    tmp_dir, downloaded, zip_path = _download_once(key)
+    if len(downloaded) < len(key):
+        # Don't pin failures for every user until the TTL runs out;
+        # the next scrape of this page retries the whole batch.
+        _download_once.clear(key)
+    return tmp_dir, downloaded, zip_path
 
 
 # ------------------------------------------------------------
@@ -104,15 +363,10 @@ if st.button("Scrape"):
                         for u in media_links:
                             st.write(u)
 
-                    tmp_dir = tempfile.mkdtemp()
                     st.info("Downloading media files...")
-                    downloaded = download_media(media_links, tmp_dir)
+                    tmp_dir, downloaded, zip_path = _download_batch(media_links)
 
                     if downloaded:
-                        # Create ZIP archive
-                        zip_path = os.path.join(tmp_dir, "media.zip")
-                        shutil.make_archive(base_name=zip_path[:-4], format="zip", root_dir=tmp_dir)
-
                         with open(zip_path, "rb") as f:
                             st.download_button(
                                 label="📦 Download all media as ZIP",
@@ -122,7 +376,7 @@ if st.button("Scrape"):
                             )
 
                         st.subheader("Preview & Individual Downloads")
-                        for file_path, url in zip(downloaded, media_links):
+                        for url, file_path in downloaded:
                             name = os.path.basename(file_path)
                             if name.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg")):
                                 st.image(file_path, caption=name, width=300)
@@ -149,6 +403,11 @@ if st.button("Scrape"):
                             st.caption(f"Source: {url}")
                     else:
                         st.info("No downloadable media could be saved.")
+
+                    # Streamlit has read every file into memory by now, and a
+                    # batch with failures isn't cached, so drop its files
+                    if len(downloaded) < len(media_links):
+                        tmp_dir.remove()
             except requests.exceptions.RequestException as exc:
                 st.error(f"❗ Network error: {exc}")
             except Exception as exc: